@@ -5,11 +5,19 @@ import stat
 import difflib
 import posixpath
 from typing import List, Tuple
-from openpyxl import Workbook
-from openpyxl.styles import PatternFill, Font, Alignment
-from openpyxl.utils import get_column_letter
 import io
+import zipfile
 import fnmatch
+import re
+import uuid
+from collections import Counter
+import queue
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+try:
+    from rapidfuzz.distance import Indel
+except ImportError:  # optional C++ diff engine; the pure-Python Myers diff is used without it
+    Indel = None
 
 # ------------------------
 # Page config
@@ -42,6 +50,23 @@ def file_diff_status(file_status: str, diff_lines):
         return "Only in New"
     return file_status
 
+def build_result_rows(differences):
+    # Single pass over differences: per-file rows plus status counts for the metrics
+    rows = []
+    counts = Counter()
+    for f, s, l in differences:
+        if s in {"Binary or unreadable file", "Ignored (pattern)"}:
+            continue
+        fname = file_name_only(f)
+        status = file_diff_status(s, l)
+        counts[status] += 1
+        rows.append({
+            "File": fname, "Status": status, "RawStatus": s, "FullPath": f, "DiffLines": l,
+            "HasChanges": status == "Changed", "_file_lower": fname.lower(),
+            "ChangedCount": sum(1 for _, _, ls in l if ls != "Unchanged") if status == "Changed" else 0,
+        })
+    return rows, counts
+
 # ------------------------
 # SFTP helpers
 # ------------------------
@@ -51,36 +76,225 @@ def connect_sftp(host, port, username, password):
     sftp = paramiko.SFTPClient.from_transport(transport)
     return sftp, transport
 
-def list_files(sftp, path):
-    files = []
-    path = path.rstrip("/")
+SFTP_POOL_SIZE = 4
+SFTP_WORKERS = 8
+# File pairs read ahead of the diffing loop; bounds how much file content is held in memory
+SFTP_READ_WINDOW = 2 * SFTP_WORKERS
+
+def open_sftp_pool(host, port, username, password, size=SFTP_POOL_SIZE):
+    # One Transport per client: a single SFTPClient must not be shared across threads
+    clients = queue.Queue()
+    transports = []
     try:
-        for entry in sftp.listdir_attr(path):
-            full = posixpath.join(path, entry.filename)
-            if stat.S_ISDIR(entry.st_mode):
-                files.extend(list_files(sftp, full))
-            else:
-                files.append(full)
+        for _ in range(size):
+            sftp, transport = connect_sftp(host, port, username, password)
+            transports.append(transport)
+            clients.put(sftp)
     except Exception:
-        pass
-    return files
+        close_sftp_pool(clients, transports)
+        raise
+    return clients, transports
+
+def close_sftp_pool(clients, transports):
+    while not clients.empty():
+        clients.get_nowait().close()
+    for transport in transports:
+        transport.close()
+
+@contextmanager
+def borrow_sftp(clients):
+    sftp = clients.get()
+    try:
+        yield sftp
+    finally:
+        clients.put(sftp)
+
+def pooled_read_file_bytes(clients, filepath):
+    with borrow_sftp(clients) as sftp:
+        return read_file_bytes(sftp, filepath)
 
-def read_file_lines(sftp, filepath):
+def pooled_listdir_attr(clients, path):
+    try:
+        with borrow_sftp(clients) as sftp:
+            return path, sftp.listdir_attr(path)
+    except Exception:
+        return path, []
+
+def list_files(clients, path, ignore_re=None):
+    # Breadth-first walk with READDIRs for sibling directories in flight concurrently.
+    # Yields (relative path, full path); files matching ignore_re are dropped here.
+    root = path.rstrip("/")
+    prefix_len = len(root) + 1
+    with ThreadPoolExecutor(max_workers=SFTP_WORKERS) as executor:
+        pending = {executor.submit(pooled_listdir_attr, clients, root)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                parent, entries = future.result()
+                for entry in entries:
+                    full = posixpath.join(parent, entry.filename)
+                    if stat.S_ISDIR(entry.st_mode):
+                        pending.add(executor.submit(pooled_listdir_attr, clients, full))
+                    else:
+                        rel = full[prefix_len:]
+                        if not should_ignore(rel, ignore_re):
+                            yield rel, full
+
+def read_file_bytes(sftp, filepath):
+    # Raw contents only: decoding and line splitting are deferred until a real diff is needed
     try:
         with sftp.open(filepath, "rb") as f:
-            return f.read().decode(errors="ignore").splitlines()
+            # pipeline the read requests instead of paying one round-trip per block
+            f.prefetch()
+            return f.read()
     except Exception:
         return None
 
+def decode_lines(raw):
+    return raw.decode(errors="ignore").splitlines()
+
 # ------------------------
 # Diff logic
 # ------------------------
+AUTOJUNK_MIN_LINES = 400
+MYERS_MIN_LINES = 2000
+# rapidfuzz's Indel builds an N*M/64-word bit matrix; above this many cells the linear-space Myers diff
+# (with its SequenceMatcher fallback for spans beyond MYERS_MAX_D) is used
+INDEL_MAX_CELLS = 100_000_000
+# Search depth cap for one middle snake (the pure-Python search is quadratic in it); deeper spans go to SequenceMatcher
+MYERS_MAX_D = 500
+
+def _middle_snake(a, alo, ahi, b, blo, bhi):
+    # Myers' bidirectional search; returns the edit count and the middle snake (x, y) -> (u, v),
+    # or None when no snake is found within MYERS_MAX_D steps from either end
+    n, m = ahi - alo, bhi - blo
+    delta = n - m
+    odd = delta & 1
+    off = (n + m + 1) // 2 + 1
+    vf = [0] * (2 * off + 1)
+    vb = [0] * (2 * off + 1)
+    for d in range(min(off, MYERS_MAX_D + 1)):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and vf[off + k - 1] < vf[off + k + 1]):
+                x = vf[off + k + 1]
+            else:
+                x = vf[off + k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            vf[off + k] = x
+            if odd and delta - (d - 1) <= k <= delta + (d - 1) and x + vb[off + delta - k] >= n:
+                return 2 * d - 1, x0, y0, x, y
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and vb[off + k - 1] < vb[off + k + 1]):
+                x = vb[off + k + 1]
+            else:
+                x = vb[off + k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[ahi - 1 - x] == b[bhi - 1 - y]:
+                x += 1
+                y += 1
+            vb[off + k] = x
+            if not odd and -d <= delta - k <= d and x + vf[off + delta - k] >= n:
+                return 2 * d, n - x, m - y, n - x0, m - y0
+    return None
+
+def _myers_matches(a, alo, ahi, b, blo, bhi, matches):
+    # linear-space divide and conquer; appends (i, j, size) equal runs in order
+    pre = 0
+    while alo + pre < ahi and blo + pre < bhi and a[alo + pre] == b[blo + pre]:
+        pre += 1
+    if pre:
+        matches.append((alo, blo, pre))
+        alo += pre
+        blo += pre
+    suf = 0
+    while alo < ahi - suf and blo < bhi - suf and a[ahi - 1 - suf] == b[bhi - 1 - suf]:
+        suf += 1
+    ahi -= suf
+    bhi -= suf
+
+    # after trimming, either one side is empty (pure insert/delete) or D >= 2 and the split makes progress
+    if alo < ahi and blo < bhi:
+        snake = _middle_snake(a, alo, ahi, b, blo, bhi)
+        if snake:
+            _, x, y, u, v = snake
+            _myers_matches(a, alo, alo + x, b, blo, blo + y, matches)
+            if u > x:
+                matches.append((alo + x, blo + y, u - x))
+            _myers_matches(a, alo + u, ahi, b, blo + v, bhi, matches)
+        else:
+            # too many edits for the capped search: SequenceMatcher with autojunk stays fast on heavy
+            # rewrites and still aligns scattered edits
+            sm = difflib.SequenceMatcher(None, a[alo:ahi], b[blo:bhi], autojunk=True)
+            matches.extend((alo + i, blo + j, size) for i, j, size in sm.get_matching_blocks() if size)
+
+    if suf:
+        matches.append((ahi, bhi, suf))
+
+def opcodes_from_matches(matches, len_a, len_b):
+    # difflib-style opcodes from ordered (i, j, size) equal runs; a delete next to an insert becomes a replace
+    opcodes = []
+    i = j = 0
+    for ai, bj, size in list(matches) + [(len_a, len_b, 0)]:
+        tag = "replace" if i < ai and j < bj else "delete" if i < ai else "insert" if j < bj else ""
+        if tag:
+            opcodes.append((tag, i, ai, j, bj))
+        if size:
+            if opcodes and opcodes[-1][0] == "equal":
+                opcodes[-1] = ("equal", opcodes[-1][1], ai + size, opcodes[-1][3], bj + size)
+            else:
+                opcodes.append(("equal", ai, ai + size, bj, bj + size))
+        i, j = ai + size, bj + size
+    return opcodes
+
+def myers_diff(a, b):
+    """Myers' O((N+M)D) linear-space diff, returned as difflib-style opcodes."""
+    matches = []
+    _myers_matches(a, 0, len(a), b, 0, len(b), matches)
+    return opcodes_from_matches(matches, len(a), len(b))
+
+def indel_diff(a, b):
+    """rapidfuzz (C++) Indel/LCS diff, returned as difflib-style opcodes."""
+    return opcodes_from_matches(Indel.editops(a, b).as_matching_blocks(), len(a), len(b))
+
 def side_by_side_diff(lines_old, lines_new):
-    diff = []
-    sm = difflib.SequenceMatcher(None, lines_old, lines_new)
-    for tag, i1, i2, j1, j2 in sm.get_opcodes():
-        old_chunk = lines_old[i1:i2]
-        new_chunk = lines_new[j1:j2]
+    # Trim the shared head and tail so the diff engine only sees the changed core
+    len_old, len_new = len(lines_old), len(lines_new)
+    limit = min(len_old, len_new)
+    pre = 0
+    while pre < limit and lines_old[pre] == lines_new[pre]:
+        pre += 1
+    suf = 0
+    while suf < limit - pre and lines_old[len_old - 1 - suf] == lines_new[len_new - 1 - suf]:
+        suf += 1
+
+    core_old = lines_old[pre:len_old - suf]
+    core_new = lines_new[pre:len_new - suf]
+
+    diff = [(l, l, "Unchanged") for l in lines_old[:pre]]
+    # Diff small ints instead of strings: each distinct line gets a collision-free id, so the
+    # engines compare ints and opcodes (index based) still slice the original lines
+    line_ids = {}
+    ids_old = [line_ids.setdefault(l, len(line_ids)) for l in core_old]
+    ids_new = [line_ids.setdefault(l, len(line_ids)) for l in core_new]
+
+    core_total = len(core_old) + len(core_new)
+    if core_total > MYERS_MIN_LINES:
+        if Indel is not None and len(ids_old) * len(ids_new) <= INDEL_MAX_CELLS:
+            opcodes = indel_diff(ids_old, ids_new)
+        else:
+            opcodes = myers_diff(ids_old, ids_new)
+    else:
+        # SequenceMatcher gives more "human" alignments on small inputs; autojunk only pays off on larger ones
+        sm = difflib.SequenceMatcher(None, ids_old, ids_new, autojunk=core_total > AUTOJUNK_MIN_LINES)
+        opcodes = sm.get_opcodes()
+    for tag, i1, i2, j1, j2 in opcodes:
+        old_chunk = core_old[i1:i2]
+        new_chunk = core_new[j1:j2]
         max_len = max(len(old_chunk), len(new_chunk))
         old_chunk += [""] * (max_len - len(old_chunk))
         new_chunk += [""] * (max_len - len(new_chunk))
@@ -92,99 +306,224 @@ def side_by_side_diff(lines_old, lines_new):
                 "Added"
             )
             diff.append((o, n, status))
+    diff.extend((l, l, "Unchanged") for l in lines_old[len_old - suf:])
     return diff
 
-def rel_map(files, root):
-    root = root.rstrip("/")
-    return {f[len(root)+1:]: f for f in files if f.startswith(root + "/")}
+def compile_ignore_patterns(patterns):
+    # One alternation of the fnmatch translations: a single regex match per file instead of one per pattern
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{fnmatch.translate(p)})" for p in patterns))
 
-def should_ignore(rel_path, patterns):
-    return any(fnmatch.fnmatch(rel_path, p) for p in patterns)
+def should_ignore(rel_path, ignore_re):
+    return ignore_re is not None and ignore_re.match(rel_path) is not None
 
-def compare_folders(sftp_old, sftp_new, folder_old, folder_new, ignore_patterns, hide_ignored, progress_callback=None):
-    files_old = rel_map(list_files(sftp_old, folder_old), folder_old)
-    files_new = rel_map(list_files(sftp_new, folder_new), folder_new)
+def compare_folders(pool_old, pool_new, folder_old, folder_new, ignore_patterns, hide_ignored, progress_callback=None):
+    ignore_re = compile_ignore_patterns(ignore_patterns)
+    # Ignored files only need listing when they are reported
+    list_ignore_re = ignore_re if hide_ignored else None
+    files_old = dict(list_files(pool_old, folder_old, list_ignore_re))
+    files_new = dict(list_files(pool_new, folder_new, list_ignore_re))
 
     all_files = sorted(set(files_old) | set(files_new))
     diffs = []
 
     total = len(all_files)
-    for i, rel in enumerate(all_files, 1):
-        po = files_old.get(rel)
-        pn = files_new.get(rel)
-
-        if should_ignore(rel, ignore_patterns):
-            if not hide_ignored:
-                diffs.append((rel, "Ignored (pattern)", []))
-            if progress_callback:
-                progress_callback(i, total, rel)
-            continue
-
-        if po and not pn:
-            diffs.append((rel, "Only in Old Folder", []))
-        elif pn and not po:
-            diffs.append((rel, "Only in New Folder", []))
-        else:
-            lo = read_file_lines(sftp_old, po)
-            ln = read_file_lines(sftp_new, pn)
-            if lo is None or ln is None:
-                diffs.append((rel, "Binary or unreadable file", []))
-            else:
-                diffs.append((rel, "Side-by-side diff", side_by_side_diff(lo, ln)))
+    with ThreadPoolExecutor(max_workers=SFTP_WORKERS) as executor:
+        # Sliding window of reads: the next pair is submitted as each one is consumed, in file order
+        to_read = iter([
+            rel for rel in all_files
+            if rel in files_old and rel in files_new and not should_ignore(rel, ignore_re)
+        ])
+        reads = {}
+
+        def submit_next_read():
+            rel = next(to_read, None)
+            if rel is not None:
+                reads[rel] = (executor.submit(pooled_read_file_bytes, pool_old, files_old[rel]),
+                              executor.submit(pooled_read_file_bytes, pool_new, files_new[rel]))
+
+        try:
+            for _ in range(SFTP_READ_WINDOW):
+                submit_next_read()
+
+            for i, rel in enumerate(all_files, 1):
+                po = files_old.get(rel)
+                pn = files_new.get(rel)
+
+                if should_ignore(rel, ignore_re):
+                    if not hide_ignored:
+                        diffs.append((rel, "Ignored (pattern)", []))
+                    if progress_callback:
+                        progress_callback(i, total, rel)
+                    continue
 
-        if progress_callback:
-            progress_callback(i, total, rel)
+                if po and not pn:
+                    diffs.append((rel, "Only in Old Folder", []))
+                elif pn and not po:
+                    diffs.append((rel, "Only in New Folder", []))
+                else:
+                    fo, fn = reads.pop(rel)
+                    submit_next_read()
+                    raw_old = fo.result()
+                    raw_new = fn.result()
+                    if raw_old is None or raw_new is None:
+                        diffs.append((rel, "Binary or unreadable file", []))
+                    elif raw_old == raw_new:
+                        # byte-identical: skip diffing, but keep the lines so a full Excel report still lists them
+                        diffs.append((rel, "Side-by-side diff", [(l, l, "Unchanged") for l in decode_lines(raw_old)]))
+                    else:
+                        diffs.append((rel, "Side-by-side diff", side_by_side_diff(decode_lines(raw_old), decode_lines(raw_new))))
+
+                if progress_callback:
+                    progress_callback(i, total, rel)
+        except BaseException:
+            # e.g. a Streamlit stop raised from progress_callback: don't wait for the queued reads
+            executor.shutdown(cancel_futures=True)
+            raise
 
     return diffs
 
 # ------------------------
 # Excel export
 # ------------------------
-def generate_excel_bytes(differences, old_label, new_label, only_diffs=True):
-    wb = Workbook()
-    ws = wb.active
-
-    ws.append([f"GK Version Comparison — Old: {old_label or 'N/A'} | New: {new_label or 'N/A'}"])
-    ws.merge_cells("A1:D1")
-    ws["A1"].font = Font(bold=True, size=14)
-    ws["A1"].alignment = Alignment(horizontal="center")
-    ws.append([])
-
-    ws.append(["File", old_label or "Old Line", new_label or "New Line", "Status"])
-    for c in range(1,5):
-        ws.cell(row=3, column=c).font = Font(bold=True)
-
-    fills = {
-        "Added": PatternFill("solid", fgColor="C6EFCE"),
-        "Removed": PatternFill("solid", fgColor="FFC7CE"),
-        "Modified": PatternFill("solid", fgColor="FFEB9C"),
-    }
-
-    for f, status, lines in differences:
-        if status in {"Binary or unreadable file", "Ignored (pattern)"}:
-            continue
+# The report is written as raw SpreadsheetML straight into the zip archive, so no
+# per-cell objects are ever allocated and peak memory does not grow with diff size.
+XLSX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+XLSX_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+XLSX_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+    '</Relationships>'
+)
+# cellXfs: 0 default, 1 Added, 2 Removed, 3 Modified, 4 bold header, 5 title
+XLSX_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="3">'
+    '<font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="14"/><name val="Calibri"/></font>'
+    '</fonts>'
+    '<fills count="5">'
+    '<fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill>'
+    '<fill><patternFill patternType="solid"><fgColor rgb="FFC6EFCE"/><bgColor indexed="64"/></patternFill></fill>'
+    '<fill><patternFill patternType="solid"><fgColor rgb="FFFFC7CE"/><bgColor indexed="64"/></patternFill></fill>'
+    '<fill><patternFill patternType="solid"><fgColor rgb="FFFFEB9C"/><bgColor indexed="64"/></patternFill></fill>'
+    '</fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="6">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="0" fillId="2" borderId="0" xfId="0" applyFill="1"/>'
+    '<xf numFmtId="0" fontId="0" fillId="3" borderId="0" xfId="0" applyFill="1"/>'
+    '<xf numFmtId="0" fontId="0" fillId="4" borderId="0" xfId="0" applyFill="1"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>'
+    '<xf numFmtId="0" fontId="2" fillId="0" borderId="0" xfId="0" applyFont="1" applyAlignment="1"><alignment horizontal="center"/></xf>'
+    '</cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+XLSX_STATUS_STYLE = {"Added": 1, "Removed": 2, "Modified": 3}
+XLSX_HEADER_STYLE = 4
+XLSX_TITLE_STYLE = 5
+XLSX_COLUMNS = ["A", "B", "C", "D"]
+# Style references are built once and shared by every row instead of formatted per cell
+XLSX_STYLE_ATTRS = [f' s="{i}"' if i else "" for i in range(XLSX_TITLE_STYLE + 1)]
+XLSX_PLAIN_ROW = ("", "", "", "")
+XLSX_STATUS_ROWS = {
+    status: ("", XLSX_STYLE_ATTRS[i], XLSX_STYLE_ATTRS[i], "") for status, i in XLSX_STATUS_STYLE.items()
+}
+
+# Escapes markup and drops control characters that are not allowed in XML 1.0
+XML_ESCAPE_TABLE = str.maketrans(
+    {"&": "&amp;", "<": "&lt;", ">": "&gt;",
+     **{c: None for c in range(0x20) if c not in (0x09, 0x0A, 0x0D)},
+     0xFFFE: None, 0xFFFF: None}
+)
 
-        fname = file_name_only(f)
+def xlsx_row(r, values, style_attrs=XLSX_PLAIN_ROW):
+    cells = []
+    for col, val, s_attr in zip(XLSX_COLUMNS, values, style_attrs):
+        if val:
+            text = val.translate(XML_ESCAPE_TABLE)
+            cells.append(f'<c r="{col}{r}" t="inlineStr"{s_attr}><is><t xml:space="preserve">{text}</t></is></c>')
+        elif s_attr:
+            cells.append(f'<c r="{col}{r}"{s_attr}/>')
+    return f'<row r="{r}">{"".join(cells)}</row>'
 
-        if status == "Side-by-side diff":
-            for o, n, s in lines:
-                if only_diffs and s == "Unchanged":
+def generate_excel_bytes(differences, old_label, new_label, only_diffs=True):
+    bio = io.BytesIO()
+    with zipfile.ZipFile(bio, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("[Content_Types].xml", XLSX_CONTENT_TYPES)
+        zf.writestr("_rels/.rels", XLSX_ROOT_RELS)
+        zf.writestr("xl/workbook.xml", XLSX_WORKBOOK)
+        zf.writestr("xl/_rels/workbook.xml.rels", XLSX_WORKBOOK_RELS)
+        zf.writestr("xl/styles.xml", XLSX_STYLES)
+
+        with zf.open("xl/worksheets/sheet1.xml", "w") as raw, io.TextIOWrapper(raw, encoding="utf-8") as out:
+            out.write(
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                '<cols><col min="1" max="4" width="50" customWidth="1"/></cols>'
+                '<sheetData>'
+            )
+            out.write(xlsx_row(1, [f"GK Version Comparison — Old: {old_label or 'N/A'} | New: {new_label or 'N/A'}"], [XLSX_STYLE_ATTRS[XLSX_TITLE_STYLE]]))
+            out.write(xlsx_row(3, ["File", old_label or "Old Line", new_label or "New Line", "Status"], [XLSX_STYLE_ATTRS[XLSX_HEADER_STYLE]] * 4))
+            r = 4
+
+            for f, status, lines in differences:
+                if status in {"Binary or unreadable file", "Ignored (pattern)"}:
                     continue
-                ws.append([fname, o, n, s])
-                if s in fills:
-                    ws.cell(row=ws.max_row, column=2).fill = fills[s]
-                    ws.cell(row=ws.max_row, column=3).fill = fills[s]
-        else:
-            ws.append([fname, "", "", file_diff_status(status, [])])
 
-    for i in range(1,5):
-        ws.column_dimensions[get_column_letter(i)].width = 50
+                fname = file_name_only(f)
+
+                if status == "Side-by-side diff":
+                    for o, n, s in lines:
+                        if only_diffs and s == "Unchanged":
+                            continue
+                        out.write(xlsx_row(r, [fname, o, n, s], XLSX_STATUS_ROWS.get(s, XLSX_PLAIN_ROW)))
+                        r += 1
+                else:
+                    out.write(xlsx_row(r, [fname, "", "", file_diff_status(status, [])]))
+                    r += 1
+
+            out.write('</sheetData><mergeCells count="1"><mergeCell ref="A1:D1"/></mergeCells></worksheet>')
 
-    bio = io.BytesIO()
-    wb.save(bio)
-    bio.seek(0)
     return bio.getvalue()
 
+@st.cache_data(show_spinner=False, max_entries=4)
+def cached_excel_bytes(run_id, keep_paths, old_label, new_label, only_diffs, _differences):
+    # _differences is not hashed: run_id (a globally unique id, since this cache is shared by all sessions)
+    # identifies the comparison, keep_paths (None = all files) the exported subset
+    if keep_paths is not None:
+        _differences = [(f,s,l) for f,s,l in _differences if f in keep_paths]
+    return generate_excel_bytes(_differences, old_label, new_label, only_diffs)
+
 # ------------------------
 # Sidebar inputs
 # ------------------------
@@ -229,19 +568,20 @@ if submitted:
         progress_bar.progress(pct)
         status_text.text(f"Processing {processed}/{total}: {current_file}")
 
-    sftp_old = sftp_new = t_old = t_new = None
+    pool_old = pool_new = None
+    transports_old, transports_new = [], []
     try:
         with st.spinner("Connecting to server(s)..."):
-            sftp_old, t_old = connect_sftp(host_old, port_old, user_old, pass_old)
+            pool_old, transports_old = open_sftp_pool(host_old, port_old, user_old, pass_old)
             if same_server:
-                sftp_new, t_new = sftp_old, t_old
+                pool_new = pool_old
             else:
-                sftp_new, t_new = connect_sftp(host_new, port_new, user_new, pass_new)
+                pool_new, transports_new = open_sftp_pool(host_new, port_new, user_new, pass_new)
 
         with st.spinner("Comparing folders..."):
             default_ignores = ["*.png","*.jpg","*.jpeg","*.gif","*.bmp","*.pdf","*.zip","*.gz","*.tar","*.7z","*.docx","*.xlsx","*.pptx"]
             differences = compare_folders(
-                sftp_old, sftp_new,
+                pool_old, pool_new,
                 folder_old, folder_new,
                 ignore_patterns=default_ignores,
                 hide_ignored=True,
@@ -249,14 +589,15 @@ if submitted:
             )
 
         st.session_state["differences"] = differences
+        st.session_state["computed_rows"], st.session_state["status_counts"] = build_result_rows(differences)
+        # st.cache_data is shared by all sessions, so the key for this run's report must be globally unique
+        st.session_state["run_id"] = uuid.uuid4().hex
         st.session_state["only_diffs_excel"] = only_diffs_excel
         st.success("Comparison complete!")
 
     finally:
-        if not same_server and sftp_new: sftp_new.close()
-        if sftp_old: sftp_old.close()
-        if t_old: t_old.close()
-        if t_new and not same_server: t_new.close()
+        if pool_new and not same_server: close_sftp_pool(pool_new, transports_new)
+        if pool_old: close_sftp_pool(pool_old, transports_old)
 
 # ------------------------
 # Display results, metrics, preview, Excel
@@ -265,16 +606,13 @@ if "differences" in st.session_state:
     differences = st.session_state["differences"]
     only_diffs_excel = st.session_state.get("only_diffs_excel", True)
 
-    # --- Compute rows & metrics ---
-    computed_rows = [
-        {"File": file_name_only(f), "Status": file_diff_status(s,l), "RawStatus": s,
-         "FullPath": f, "DiffLines": l, "HasChanges": any(ls!="Unchanged" for _,_,ls in l)}
-        for f,s,l in differences if s not in {"Binary or unreadable file","Ignored (pattern)"}
-    ]
-    total_changed = sum(1 for r in computed_rows if r["Status"]=="Changed")
-    total_only_old = sum(1 for r in computed_rows if r["Status"]=="Only in Old")
-    total_only_new = sum(1 for r in computed_rows if r["Status"]=="Only in New")
-    total_text_diffed = sum(1 for r in computed_rows if r["RawStatus"]=="Side-by-side diff")
+    # --- Rows & metrics (built once per comparison run, reused across reruns) ---
+    computed_rows = st.session_state["computed_rows"]
+    counts = st.session_state["status_counts"]
+    total_changed = counts["Changed"]
+    total_only_old = counts["Only in Old"]
+    total_only_new = counts["Only in New"]
+    total_text_diffed = counts["Changed"] + counts["No differences"]
 
     c1,c2,c3,c4 = st.columns(4)
     c1.metric("Changed", total_changed)
@@ -289,13 +627,13 @@ if "differences" in st.session_state:
     file_search = st.text_input("Search file names (contains)")
     has_changes_filter = st.checkbox("Only show files with changes", value=False)
 
-    filtered_rows = computed_rows
-    if selected_statuses:
-        filtered_rows = [r for r in filtered_rows if r["Status"] in selected_statuses]
-    if file_search:
-        filtered_rows = [r for r in filtered_rows if file_search.lower() in r["File"].lower()]
-    if has_changes_filter:
-        filtered_rows = [r for r in filtered_rows if r.get("HasChanges")]
+    file_search_lower = file_search.lower()
+    filtered_rows = [
+        r for r in computed_rows
+        if (not selected_statuses or r["Status"] in selected_statuses)
+        and file_search_lower in r["_file_lower"]
+        and (not has_changes_filter or r["HasChanges"])
+    ]
 
     st.dataframe([{"File": r["File"], "Status": r["Status"]} for r in filtered_rows], use_container_width=True)
 
@@ -305,12 +643,19 @@ if "differences" in st.session_state:
         st.subheader("Preview changed lines")
         sel_file = st.selectbox("Choose file", [r["File"] for r in preview_candidates], key="preview_file")
         sel_row = next(r for r in preview_candidates if r["File"]==sel_file)
-        changed_lines = [(o,n,s) for o,n,s in sel_row["DiffLines"] if s!="Unchanged"]
+        changed_count = sel_row["ChangedCount"]
 
-        if changed_lines:
+        if changed_count:
             MAX_PREVIEW = 500
-            preview_rows = changed_lines[:MAX_PREVIEW]
-            st.caption(f"Showing first {len(preview_rows)} of {len(changed_lines)} changed lines")
+            # Stop scanning once the preview is full; the total was counted when the rows were built
+            preview_rows = []
+            for o,n,s in sel_row["DiffLines"]:
+                if s=="Unchanged":
+                    continue
+                preview_rows.append((o,n,s))
+                if len(preview_rows) >= MAX_PREVIEW:
+                    break
+            st.caption(f"Showing first {len(preview_rows)} of {changed_count} changed lines")
             st.dataframe([{"Old":o,"New":n,"Status":s} for o,n,s in preview_rows], use_container_width=True)
         else:
             st.info("No changed lines to preview.")
@@ -318,16 +663,22 @@ if "differences" in st.session_state:
     # --- Excel download with optional filter ---
     st.subheader("Download Excel report")
     apply_filter_to_excel = st.checkbox("Apply file status filter to Excel export", value=False)
-    if apply_filter_to_excel:
-        keep_paths = {r["FullPath"] for r in filtered_rows}
-        export_differences = [(f,s,l) for f,s,l in differences if f in keep_paths]
+    keep_paths = frozenset(r["FullPath"] for r in filtered_rows) if apply_filter_to_excel else None
+    excel_args = (st.session_state["run_id"], keep_paths, old_label, new_label, only_diffs_excel)
+
+    # Build the report only on request and keep the bytes in this session, so filter interaction
+    # (or another session evicting the shared cache) never regenerates it on a plain rerun
+    if st.button("Prepare Excel"):
+        with st.spinner("Building Excel report..."):
+            st.session_state["excel_report"] = (excel_args, cached_excel_bytes(*excel_args, differences))
+
+    prepared = st.session_state.get("excel_report")
+    if prepared and prepared[0] == excel_args:
+        st.download_button(
+            "📥 Download Excel",
+            prepared[1],
+            "side_by_side_report.xlsx",
+            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        )
     else:
-        export_differences = differences
-
-    excel_bytes = generate_excel_bytes(export_differences, old_label, new_label, only_diffs_excel)
-    st.download_button(
-        "📥 Download Excel",
-        excel_bytes,
-        "side_by_side_report.xlsx",
-        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
+        st.caption("Click \"Prepare Excel\" to build the report for the current settings.")
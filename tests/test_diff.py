@@ -0,0 +1,77 @@
+import io
+import os
+import queue
+import random
+from collections import Counter
+
+import pytest
+
+pytest.importorskip("streamlit")
+paramiko = pytest.importorskip("paramiko")
+
+import app
+
+
+def sparse_edits(n, edits, seed=1):
+    old = [f"line {i}" for i in range(n)]
+    new = list(old)
+    for k in random.Random(seed).sample(range(n), edits):
+        new[k] = f"edited {k}"
+    return old, new
+
+
+@pytest.mark.parametrize("n, edits", [(5000, 600), (20000, 600), (50000, 3000)])
+def test_myers_many_sparse_edits(n, edits):
+    old, new = sparse_edits(n, edits)
+    changed = Counter()
+    for tag, i1, i2, j1, j2 in app.myers_diff(old, new):
+        changed[tag] += max(i2 - i1, j2 - j1)
+    assert changed == {"equal": n - edits, "replace": edits}
+
+
+def test_side_by_side_many_sparse_edits_without_rapidfuzz(monkeypatch):
+    monkeypatch.setattr(app, "Indel", None)
+    old, new = sparse_edits(20000, 600)
+    statuses = Counter(s for _, _, s in app.side_by_side_diff(old, new))
+    assert statuses == {"Unchanged": 19400, "Modified": 600}
+
+
+def test_side_by_side_many_sparse_edits_over_indel_budget():
+    # 20k x 20k lines exceeds INDEL_MAX_CELLS, so this goes through Myers even with rapidfuzz installed
+    old, new = sparse_edits(20000, 600)
+    assert len(old) * len(new) > app.INDEL_MAX_CELLS
+    statuses = Counter(s for _, _, s in app.side_by_side_diff(old, new))
+    assert statuses == {"Unchanged": 19400, "Modified": 600}
+
+
+def test_myers_full_rewrite():
+    old = [f"a{i}" for i in range(10000)]
+    new = [f"b{i}" for i in range(10000)]
+    assert app.myers_diff(old, new) == [("replace", 0, 10000, 0, 10000)]
+
+
+class LocalSFTP:
+    """Just enough of paramiko.SFTPClient to run compare_folders against local folders."""
+
+    def listdir_attr(self, path):
+        return [paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(path, name)), name) for name in os.listdir(path)]
+
+    def open(self, path, mode="r"):
+        return LocalFile(path)
+
+
+class LocalFile(io.FileIO):
+    def prefetch(self):
+        pass
+
+
+def test_identical_files_keep_unchanged_rows_for_full_report(tmp_path):
+    for side in ("old", "new"):
+        (tmp_path / side).mkdir()
+        (tmp_path / side / "same.txt").write_text("a\nb\n")
+    clients = queue.Queue()
+    clients.put(LocalSFTP())
+
+    diffs = app.compare_folders(clients, clients, str(tmp_path / "old"), str(tmp_path / "new"), [], True)
+    assert diffs == [("same.txt", "Side-by-side diff", [("a", "a", "Unchanged"), ("b", "b", "Unchanged")])]
+    assert app.file_diff_status(*diffs[0][1:]) == "No differences"